@@ -0,0 +1,141 @@
+"""
+Buffered, non-blocking audit log sink.
+
+audit_log from dv_utils writes synchronously to the log sink. The processors call audit_log
+from this module instead: records are put in a bounded queue and written in batches by a
+background thread, so that auditing at batch or partition granularity does not slow down the
+hot path. A record is built when it is enqueued, so its timestamps and event metadata are the
+ones of the caller, the thread only writes it. The queue is flushed at the end of every event
+and on interpreter exit, a full queue blocks the caller instead of dropping records.
+"""
+
+import atexit
+import datetime
+import logging
+import queue
+import sys
+import threading
+
+from dv_utils import LogLevel
+from dv_utils.log_utils import create_body
+
+logger = logging.getLogger(__name__)
+
+MAX_QUEUE_SIZE = 10000
+BATCH_SIZE = 100
+FLUSH_INTERVAL = 1.0  # seconds
+
+_STOP = object()
+
+
+def create_record(log, level=LogLevel.AUDIT, **kwargs):
+    """
+    Build an audit record like the dv_utils audit log: a timestamped header and the log body.
+    """
+    header = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3] + " - AUDIT - "
+    return header, create_body(log, level, **kwargs)
+
+
+def write_batch(records):
+    """
+    Default batch writer, prints every record to the log sink like the dv_utils audit log.
+    """
+    for header, body in records:
+        print(header + str(body), file=sys.stderr)
+
+
+class BufferedAuditSink:
+    """
+    Queue audit records and write them in batches from a background thread.
+    """
+
+    def __init__(self, writer=write_batch, max_queue_size=MAX_QUEUE_SIZE, batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL):
+        self.writer = writer
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(maxsize=max_queue_size)
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        # the thread is started on the first record, importing this module stays cheap
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.run, name="audit-log-sink", daemon=True)
+                self.thread.start()
+
+    def log(self, log, level=LogLevel.AUDIT, **kwargs):
+        """
+        Enqueue an audit record. Blocks only when the queue is full.
+        """
+        if log is None:
+            return
+        record = create_record(log, level, **kwargs)
+        self.start()
+        self.queue.put(record)
+
+    def flush(self):
+        """
+        Block until every record enqueued so far has been written.
+        """
+        if self.thread is not None and self.thread.is_alive():
+            self.queue.join()
+
+    def close(self):
+        """
+        Write the remaining records and stop the background thread.
+        """
+        if self.thread is not None and self.thread.is_alive():
+            self.queue.put(_STOP)
+            self.thread.join()
+
+    def run(self):
+        stopped = False
+        while not stopped:
+            try:
+                record = self.queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            batch = []
+            while True:
+                if record is _STOP:
+                    stopped = True
+                    self.queue.task_done()
+                else:
+                    batch.append(record)
+                if stopped or len(batch) >= self.batch_size:
+                    break
+                try:
+                    record = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+            self.write(batch)
+
+    def write(self, batch):
+        if len(batch) == 0:
+            return
+        try:
+            self.writer(batch)
+        except Exception as e:
+            # keep the records in the application logs when the sink fails
+            logger.error(f"Audit log sink failed: {e}")
+            for header, body in batch:
+                logger.error(header + str(body))
+        finally:
+            for _ in batch:
+                self.queue.task_done()
+
+
+audit_sink = BufferedAuditSink()
+atexit.register(audit_sink.close)
+
+
+def audit_log(log, level=LogLevel.AUDIT, **kwargs):
+    """
+    Same signature as dv_utils audit_log, but non-blocking.
+    """
+    audit_sink.log(log, level, **kwargs)
+
+
+def flush_audit_log():
+    audit_sink.flush()
@@ -0,0 +1,75 @@
+"""
+Startup-time benchmark of the cage.
+
+For every event type, a fresh interpreter measures the time to import the listener entry point
+(process) and the first-event latency: loading the event processor module and its dependencies
+and, with --run, processing the event itself.
+
+    python bench_startup.py [--repeat 5] [--run] [EVENT_TYPE ...]
+
+--run sends real events to the processors, it needs the same environment as the tests (.env).
+Events write to their config and output locations (INITIALIZE and ROTATE_KEYS replace the keys),
+so every run gets a copy of the fixtures in a temporary directory and the tree is left untouched.
+"""
+
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+# executed in a fresh interpreter for each measurement, so that no module is already imported
+MEASURE = """
+import json, sys, time
+start = time.perf_counter()
+import process
+imported = time.perf_counter()
+processor = process.get_event_processor(sys.argv[1])
+loaded = time.perf_counter()
+if sys.argv[2] == "run":
+    process.event_processor({"type": sys.argv[1]})
+processed = time.perf_counter()
+print(json.dumps({"import": imported - start, "load": loaded - imported, "first_event": processed - imported}))
+"""
+
+
+def measure(evt_type, run, fixtures):
+    env = dict(os.environ)
+    with tempfile.TemporaryDirectory() as location:
+        if run:
+            # environment variables take precedence over the .env file
+            shutil.copytree(fixtures, location + "/config")
+            os.makedirs(location + "/outputs")
+            env["DATA_CONNECTOR_CONFIG_LOCATION"] = location + "/config"
+            env["DATA_USER_OUTPUT_LOCATION"] = location + "/outputs"
+        completed = subprocess.run(
+            [sys.executable, "-c", MEASURE, evt_type, "run" if run else "load"],
+            capture_output=True, text=True, check=True, env=env,
+        )
+    # the processors log on stdout, the measure is the last line
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("event_types", nargs="*", help="event types to measure, all registered ones by default")
+    parser.add_argument("--repeat", type=int, default=5, help="number of fresh interpreters per event type")
+    parser.add_argument("--run", action="store_true", help="also process the event")
+    parser.add_argument("--fixtures", default="tests/fixtures", help="config location copied for every processed event")
+    args = parser.parse_args()
+
+    import process
+    event_types = args.event_types or list(process.EVENT_PROCESSORS)
+
+    print(f"{'event type':<25} {'import (s)':>12} {'load (s)':>12} {'first event (s)':>16}")
+    for evt_type in event_types:
+        results = [measure(evt_type, args.run, args.fixtures) for _ in range(args.repeat)]
+        median = {key: statistics.median(result[key] for result in results) for key in results[0]}
+        print(f"{evt_type:<25} {median['import']:>12.3f} {median['load']:>12.3f} {median['first_event']:>16.3f}")
+
+
+if __name__ == "__main__":
+    main()
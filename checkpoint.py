@@ -0,0 +1,150 @@
+"""
+Checkpoints of a FUSE event.
+
+Every data contract is fused in numbered chunks. The encrypted output of each chunk and a
+progress manifest are persisted in the config location as soon as the chunk is done, so that a
+FUSE event re-sent after a crash or a cage restart resumes from the last completed chunk and
+skips the contracts already fused. The progress is only valid for the keys, data contracts and
+chunking it was computed with, any change starts the fusion over. A source whose number of rows
+changed since its progress was recorded is fused again from its first chunk.
+
+Layout in the config location:
+
+    fuse_checkpoint/progress.json                               progress manifest
+    fuse_checkpoint/customers_list_<i>/chunk_<k>.parquet        chunk k of table i
+    fuse_checkpoint/source_<i>.parquet                          snapshot of the source of table i (partitioned fusion)
+    fuse_checkpoint/partitions/bucket_<b>/...                   partitioned fusion (see partition.py)
+"""
+
+import os
+import glob
+import json
+import shutil
+from hashlib import sha256
+
+import partition
+
+CHECKPOINT_DIRECTORY = "fuse_checkpoint"
+PROGRESS_MANIFEST = "progress.json"
+CHUNK_SIZE = 10000
+
+
+def checkpoint_location(config_location):
+    return config_location + "/" + CHECKPOINT_DIRECTORY
+
+
+def chunk_location(config_location, table_index):
+    return checkpoint_location(config_location) + "/customers_list_" + str(table_index)
+
+
+def chunk_path(config_location, table_index, chunk_index):
+    return chunk_location(config_location, table_index) + "/chunk_" + str(chunk_index) + ".parquet"
+
+
+def source_path(config_location, table_index):
+    return checkpoint_location(config_location) + "/source_" + str(table_index) + ".parquet"
+
+
+def fingerprint(public_keys, data_contract_ids, chunk_size, num_partitions):
+    """
+    Identify the inputs of a fusion: a checkpoint computed with other keys, contracts or chunking is discarded.
+    """
+    inputs = {
+        "public_keys": public_keys,
+        "data_contracts": data_contract_ids,
+        "chunk_size": chunk_size,
+        "partitions": num_partitions,
+    }
+    return sha256(json.dumps(inputs, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def load_progress(config_location, fingerprint):
+    """
+    Return the progress of the fusion to resume, or a new one if there is none for these inputs.
+    """
+    path = checkpoint_location(config_location) + "/" + PROGRESS_MANIFEST
+    if os.path.exists(path):
+        with open(path) as f:
+            progress = json.load(f)
+        if progress["fingerprint"] == fingerprint:
+            return progress
+    clear(config_location)
+    os.makedirs(checkpoint_location(config_location))
+    progress = {"fingerprint": fingerprint, "contracts": {}}
+    save_progress(config_location, progress)
+    return progress
+
+
+def save_progress(config_location, progress):
+    # written atomically, the manifest never references a chunk that is not on disk
+    path = checkpoint_location(config_location) + "/" + PROGRESS_MANIFEST
+    with open(path + ".tmp", "w", newline="") as file:
+        file.write(json.dumps(progress, indent=4))
+    os.replace(path + ".tmp", path)
+
+
+def num_chunks(num_rows, chunk_size):
+    # an empty source still has one (empty) chunk, which keeps its schema
+    return max(1, -(-num_rows // chunk_size))
+
+
+def contract_progress(config_location, progress, data_contract_id, table_index, num_rows, chunk_size):
+    """
+    Return the progress of a data contract, completed chunks are indexed by their number.
+    The chunks of a source whose number of rows changed are discarded and the contract starts over.
+    """
+    contract = progress["contracts"].get(data_contract_id)
+    if contract is None or contract["rows"] != num_rows:
+        discard_chunks(config_location, table_index)
+        contract = {"table": table_index, "rows": num_rows, "chunks": num_chunks(num_rows, chunk_size), "completed": {}}
+        progress["contracts"][data_contract_id] = contract
+        save_progress(config_location, progress)
+    return contract
+
+
+def discard_chunks(config_location, table_index):
+    shutil.rmtree(chunk_location(config_location, table_index), ignore_errors=True)
+    pattern = partition.bucket_location(checkpoint_location(config_location), "*") + "/customers_list_" + str(table_index) + "-*.parquet"
+    for path in glob.glob(pattern):
+        os.remove(path)
+
+
+def is_contract_done(progress, data_contract_id):
+    contract = progress["contracts"].get(data_contract_id)
+    return contract is not None and len(contract["completed"]) == contract["chunks"]
+
+
+def is_chunk_done(progress, data_contract_id, chunk_index):
+    contract = progress["contracts"].get(data_contract_id)
+    return contract is not None and str(chunk_index) in contract["completed"]
+
+
+def complete_chunk(config_location, progress, data_contract_id, chunk_index, result):
+    """
+    Record a completed chunk with its result (number of rows, or rows per bucket for a partitioned fusion).
+    """
+    progress["contracts"][data_contract_id]["completed"][str(chunk_index)] = result
+    save_progress(config_location, progress)
+
+
+def write_chunk(con, config_location, table_index, chunk_index, query):
+    """
+    Write the result of a query as the output of a chunk.
+    """
+    os.makedirs(chunk_location(config_location, table_index), exist_ok=True)
+    path = chunk_path(config_location, table_index, chunk_index)
+    con.sql("COPY (" + query + ") TO '" + path + ".tmp' (FORMAT PARQUET)")
+    os.replace(path + ".tmp", path)
+
+
+def write_source(con, config_location, table_index, query):
+    """
+    Write a snapshot of the source of a table, worker processes read their chunks from it.
+    """
+    path = source_path(config_location, table_index)
+    con.sql("COPY (" + query + ") TO '" + path + ".tmp' (FORMAT PARQUET)")
+    os.replace(path + ".tmp", path)
+
+
+def clear(config_location):
+    shutil.rmtree(checkpoint_location(config_location), ignore_errors=True)
@@ -0,0 +1,173 @@
+"""
+CHECK_* event processors: data quality of the contracts, common customers and valid customer on the fused data.
+"""
+
+import logging
+import time
+import json
+import os
+import duckdb
+from concurrent.futures import ProcessPoolExecutor
+
+import commutative
+import partition
+
+from dv_utils import default_settings, ContractManager, LogLevel
+from audit import audit_log
+
+logger = logging.getLogger(__name__)
+
+def check_data_quality_contracts_event_processor(evt: dict):
+    #audit logs are generated by the dv_utils sdk
+    try:
+        contractManager=ContractManager()
+        contractManager.check_contracts_for_collaboration_space(default_settings.collaboration_space_id)
+    except Exception as e:
+        logger.error(e)
+
+def partitioned_check_common_customers(evt: dict, manifest):
+    """
+    Intersect every bucket of a partitioned fusion in its own worker process
+    and merge the per-bucket counts and overlap matrices into the report.
+    """
+    config_location=default_settings.data_connector_config_location
+    num_partitions=manifest["partitions"]
+    num_tables=manifest["tables"]
+    num_workers=int(evt.get("workers", os.cpu_count() or 1))
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        results=[]
+        for result in executor.map(partition.intersect_bucket_worker,[config_location]*num_partitions,range(num_partitions),[num_tables]*num_partitions):
+            audit_log(f"Intersected partition {result['bucket']}.",LogLevel.INFO)
+            results.append(result)
+    merged=partition.merge_bucket_results(results,num_tables)
+
+    logger.info(f"| 3. Send output                                        |")
+    output_json={}
+    output_json["common_customers"]={"by_email":str(merged["overlap"][0][1]) if num_tables>1 else "0"}
+    output_json["overlap_matrix"]=merged["overlap"]
+    output_json["rows"]=merged["rows"]
+    output_json["partitions"]=num_partitions
+    with open(default_settings.data_user_output_location+'/report.json', 'w', newline='') as file:
+            file.write(json.dumps(output_json, indent=4))
+
+def check_common_customers_event_processor(evt: dict):
+    logger.info(f"---------------------------------------------------------")
+    logger.info(f"|                    START PROCESSING                   |")
+    logger.info(f"|                                                       |")
+    start_time = time.time()
+    logger.info(f"|    Start time:  {start_time} secs               |")
+    logger.info(f"|                                                       |")
+    audit_log(f"Start processing event: {evt.get('type', '')}.",LogLevel.INFO)
+    try:
+       
+        logger.info(f"| 1. Evaluate common customers                          |")
+        logger.info(f"|                                                       |")
+        manifest=partition.load_manifest(default_settings.data_connector_config_location)
+        if manifest != None:
+            partitioned_check_common_customers(evt,manifest)
+            execution_time=(time.time() - start_time)
+            logger.info(f"|    Execution time:  {execution_time} secs           |")
+            logger.info(f"|                                                       |")
+            logger.info(f"--------------------------------------------------------")
+            return
+        #Connect in memory duckdb (encrypted memory on confidential computing)
+        con = duckdb.connect(database=":memory:")
+        con.sql("IMPORT DATABASE '"+default_settings.data_connector_config_location+"'") 
+        #check if tables exist in memory
+        existing_tables=con.sql("SHOW ALL TABLES; ")
+        if len(existing_tables)>0:
+            #check common customers by email in the database in memory
+            #Common customers by email
+            #Create duckdb query
+            query="SELECT COUNT(*) as total FROM customers_list_0,customers_list_1 WHERE (customers_list_0.commutative_id=customers_list_1.commutative_id)"
+            df = con.sql(query).df()
+            common_customers_by_email=df["total"].to_string(index=False)
+
+            #Write outputs for data user
+            #For now the output is written in an encrypted drive only accessible for data user
+            #TODO Connector for data users (write) have to be created
+            logger.info(f"| 3. Send output                                        |")
+            output_json={}
+            output_json["common_customers"]={"by_email":common_customers_by_email}
+            with open(default_settings.data_user_output_location+'/report.json', 'w', newline='') as file:
+                    file.write(json.dumps(output_json, indent=4))
+            logger.info(f"|                                                       |")
+            execution_time=(time.time() - start_time)
+            logger.info(f"|    Execution time:  {execution_time} secs           |")
+            logger.info(f"|                                                       |")
+            logger.info(f"--------------------------------------------------------")
+
+        else:
+            logger.error(f"No table exist in memory, please initialise the fusion")
+    except Exception as e:
+        logger.error(e) 
+    
+def check_valid_customer_event_processor(evt: dict):
+    logger.info(f"---------------------------------------------------------")
+    logger.info(f"|                    START PROCESSING                   |")
+    logger.info(f"|                                                       |")
+    start_time = time.time()
+    logger.info(f"|    Start time:  {start_time} secs               |")
+    logger.info(f"|                                                       |")
+    audit_log(f"Start processing event: {evt.get('type', '')}.",LogLevel.INFO)
+    try:
+        logger.info(f"| 2. Load keys and fuse parameter                       |")
+        logger.info(f"|                                                       |")
+        engine = commutative.load_engine(default_settings.data_connector_config_location)
+        with open(default_settings.data_connector_config_location+'/public_keys.json') as f:
+            public_keys = json.load(f)
+        
+        email= evt.get("email", "")
+        #TODO need to load participant (parameter sender) dynamically
+        participant="66e1a419eb0cbee048a2bce3"
+        commutative_email=commutative.tee_commutative_encrypt(email,participant,public_keys,engine)
+                    
+        logger.info(f"| 1. Check valid customers                              |")
+        logger.info(f"|                                                       |")
+        manifest=partition.load_manifest(default_settings.data_connector_config_location)
+        if manifest != None:
+            #only the bucket of the commutative email is read
+            found=partition.lookup_commutative_id(default_settings.data_connector_config_location,commutative_email,manifest["partitions"],manifest["tables"])
+            logger.info(f"| 3. Send output                                        |")
+            output_json={}
+            output_json["valid_customer"]="true" if all(found) else "false"
+            with open(default_settings.data_user_output_location+'/report.json', 'w', newline='') as file:
+                    file.write(json.dumps(output_json, indent=4))
+            execution_time=(time.time() - start_time)
+            logger.info(f"|    Execution time:  {execution_time} secs           |")
+            logger.info(f"|                                                       |")
+            logger.info(f"--------------------------------------------------------")
+            return
+        #Connect in memory duckdb (encrypted memory on confidential computing)
+        con = duckdb.connect(database=":memory:")
+        con.sql("IMPORT DATABASE '"+default_settings.data_connector_config_location+"'") 
+        #check if tables exist in memory
+        existing_tables=con.sql("SHOW ALL TABLES; ")
+        if len(existing_tables)>0:
+            #check common customers by email in the database in memory
+            #Common customers by email
+            #Create duckdb query
+            query="SELECT COUNT(*) as total FROM customers_list_0,customers_list_1 WHERE (customers_list_0.commutative_id='"+str(commutative_email)+"' AND customers_list_1.commutative_id='"+str(commutative_email)+"')"
+            df = con.sql(query).df()
+            valid_customers_found="false"
+            if int(df["total"].to_string(index=False))>0:
+                valid_customers_found="true"
+
+            #Write outputs for data user
+            #For now the output is written in an encrypted drive only accessible for data user
+            #TODO Connector for data users (write) have to be created
+            logger.info(f"| 3. Send output                                        |")
+            output_json={}
+            output_json["valid_customer"]=valid_customers_found
+            with open(default_settings.data_user_output_location+'/report.json', 'w', newline='') as file:
+                    file.write(json.dumps(output_json, indent=4))
+            logger.info(f"|                                                       |")
+            execution_time=(time.time() - start_time)
+            logger.info(f"|    Execution time:  {execution_time} secs           |")
+            logger.info(f"|                                                       |")
+            logger.info(f"--------------------------------------------------------")
+
+        else:
+            logger.error(f"No table exist in memory, please initialise the fusion")
+    except Exception as e:
+        logger.error(e)
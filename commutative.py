@@ -0,0 +1,213 @@
+"""
+Commutative encryption engines.
+
+An engine encrypts identifiers with a per-participant key so that the order in which the keys
+are applied does not matter: E_a(E_b(x)) = E_b(E_a(x)). Two engines are available:
+
+- modexp: E_k(x) = x^k mod n over a 2048-bit RSA-style modulus generated at INITIALIZE.
+  Identifiers are integers (617 digits).
+- ristretto255: E_k(P) = k*P on the prime-order Ristretto255 group, identifiers are hashed to
+  the curve. Scalar multiplications are much cheaper than 2048-bit modexp and identifiers are
+  32-byte points, stored hex-encoded.
+
+The engine is selected at INITIALIZE and recorded in the key material (shared_modulus.json),
+key material written before engines existed is read as modexp.
+"""
+
+import json
+import secrets
+from math import gcd
+from hashlib import sha256, sha512
+
+DEFAULT_ENGINE = "modexp"
+
+# order of the Ristretto255 group
+RISTRETTO255_ORDER = 2**252 + 27742317777372353535851937790883648493
+
+
+# Commutative encryption: E_k(x) = x^k mod n
+def commutative_encrypt(value, key, n):
+    return pow(value, key, n)
+
+
+# Generate large prime modulus n and phi(n)
+def tee_generate_shared_modulus():
+    from sympy import nextprime
+
+    p = nextprime(secrets.randbelow(2**1023) + 2**1022)
+    q = nextprime(secrets.randbelow(2**1023) + 2**1022)
+    n = p * q
+    phi = (p - 1) * (q - 1)
+    return n, phi
+
+
+# Generate commutative encryption keys (k, d such that k * d = 1 mod phi)
+def generate_unique_commutative_keys(phi, num_keys):
+    """
+    Generate a specified number of unique commutative key pairs (k, d)
+    for the same modulus φ(n).
+    """
+    used_keys = set()
+    keys = []
+
+    while len(keys) < num_keys:
+        # Generate random k
+        k = secrets.randbelow(phi - 2) + 2  # Ensure k is in range [2, φ(n)-1]
+        if gcd(k, phi) == 1 and k not in used_keys:  # Ensure k is coprime and unique
+            d = pow(k, -1, phi)  # Modular inverse of k
+            keys.append(d)
+            used_keys.add(k)  # Mark k as used
+
+    return keys
+
+
+class ModExpEngine:
+    """
+    Commutative exponentiation modulo a shared RSA-style modulus n.
+    """
+
+    name = "modexp"
+
+    def __init__(self, n):
+        self.n = n
+
+    @staticmethod
+    def generate_key_material(num_keys):
+        """
+        Return the shared parameters to keep in the secret store and one key per participant.
+        """
+        n, phi = tee_generate_shared_modulus()
+        shared = {"engine": ModExpEngine.name, "phi": phi, "n": n}
+        return shared, generate_unique_commutative_keys(phi, num_keys)
+
+    @staticmethod
+    def rotate_keys(shared, num_keys):
+        """
+        Generate a new generation of keys under the current modulus, so that fused ids can be re-exponentiated.
+        """
+        return generate_unique_commutative_keys(shared["phi"], num_keys)
+
+    @staticmethod
+    def rotation_key(shared, old_keys, new_keys):
+        """
+        Single exponent moving a fused id from the old keys to the new ones: x^(prod old) -> x^(prod new).
+        """
+        phi = shared["phi"]
+        delta = 1
+        for old_key, new_key in zip(old_keys, new_keys):
+            delta = delta * new_key * pow(old_key, -1, phi) % phi
+        return delta
+
+    def public_parameters(self):
+        """
+        Parameters shared with the participants together with their key.
+        """
+        return {"engine": self.name, "n": self.n}
+
+    def hash_identifier(self, identifier):
+        # Securely hash identifier to integers
+        digest = sha256(identifier.encode('utf-8')).digest()
+        return int.from_bytes(digest, 'big') % self.n
+
+    def encrypt(self, value, key):
+        return commutative_encrypt(int(value), key, self.n)
+
+
+class Ristretto255Engine:
+    """
+    Commutative scalar multiplication on the Ristretto255 group (libsodium through pysodium).
+    Keys are scalars stored as integers, identifiers are hex-encoded 32-byte points.
+    """
+
+    name = "ristretto255"
+
+    @staticmethod
+    def sodium():
+        # loaded lazily, only the deployments using this engine need libsodium
+        import pysodium
+        return pysodium
+
+    @staticmethod
+    def scalar_to_bytes(key):
+        return int(key).to_bytes(32, "little")
+
+    @staticmethod
+    def generate_key_material(num_keys):
+        sodium = Ristretto255Engine.sodium()
+        keys = []
+        while len(keys) < num_keys:
+            # random scalars are non zero, hence invertible in the prime-order group
+            k = int.from_bytes(sodium.crypto_core_ristretto255_scalar_random(), "little")
+            if k not in keys:
+                keys.append(k)
+        return {"engine": Ristretto255Engine.name}, keys
+
+    @staticmethod
+    def rotate_keys(shared, num_keys):
+        return Ristretto255Engine.generate_key_material(num_keys)[1]
+
+    @staticmethod
+    def rotation_key(shared, old_keys, new_keys):
+        delta = 1
+        for old_key, new_key in zip(old_keys, new_keys):
+            delta = delta * new_key * pow(old_key, -1, RISTRETTO255_ORDER) % RISTRETTO255_ORDER
+        return delta
+
+    def public_parameters(self):
+        return {"engine": self.name}
+
+    def hash_identifier(self, identifier):
+        # hash-to-curve (Elligator 2 on a 64-byte hash)
+        digest = sha512(identifier.encode('utf-8')).digest()
+        return self.sodium().crypto_core_ristretto255_from_hash(digest).hex()
+
+    def encrypt(self, value, key):
+        point = bytes.fromhex(str(value))
+        return self.sodium().crypto_scalarmult_ristretto255(self.scalar_to_bytes(key), point).hex()
+
+
+def tee_commutative_encrypt(data, company, public_keys, engine):
+    """
+    TEE applies additional rounds of commutative encryption using public keys.
+    """
+    # Apply additional commutative encryptions
+    value = data
+    for other_company, public_key in public_keys.items():
+        if other_company != company:
+            value = engine.encrypt(value, public_key)
+    return value
+
+
+ENGINES = {
+    ModExpEngine.name: ModExpEngine,
+    Ristretto255Engine.name: Ristretto255Engine,
+}
+
+
+def generate_key_material(engine_name, num_keys):
+    """
+    Generate the shared parameters and the participant keys of an engine.
+    """
+    if engine_name not in ENGINES:
+        raise ValueError(f"Unknown commutative encryption engine: {engine_name}")
+    return ENGINES[engine_name].generate_key_material(num_keys)
+
+
+def get_engine(shared):
+    """
+    Return the engine recorded in the key material (content of shared_modulus.json or of a participant key file).
+    """
+    engine_name = shared.get("engine", DEFAULT_ENGINE)
+    if engine_name == ModExpEngine.name:
+        return ModExpEngine(shared["n"])
+    if engine_name == Ristretto255Engine.name:
+        return Ristretto255Engine()
+    raise ValueError(f"Unknown commutative encryption engine: {engine_name}")
+
+
+def load_engine(config_location):
+    """
+    Load the engine recorded with the key material at INITIALIZE.
+    """
+    with open(config_location + '/shared_modulus.json') as f:
+        return get_engine(json.load(f))
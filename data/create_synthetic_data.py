@@ -4,12 +4,16 @@ Create synthetic data for the demo use case
 
 import random
 import json
+import sys
 
 import duckdb
 from duckdb.typing import *
 
 from faker import Faker
-from hashlib import sha256
+
+# the script is run from the repository root, like the fixture paths below
+sys.path.append(".")
+from commutative import get_engine
 
 
 
@@ -60,19 +64,9 @@ locales = [
 
 currentLocale="fr_CA"
 
-# Commutative encryption: E_k(x) = x^k mod n
-def commutative_encrypt(value, key, n):
-    return pow(value, key, n)
-
-# Securely hash email to integers
-def hash_email_to_int(email, n):
-    digest = sha256(email.encode('utf-8')).digest()
-    return int.from_bytes(digest, 'big') % n
-
-# Encrypt email 
+# Encrypt email with the engine selected at INITIALIZE
 def encrypt_email(email):
-    email_int = hash_email_to_int(email, encrypt_n)
-    return commutative_encrypt(email_int, public_key, encrypt_n)
+    return engine.encrypt(engine.hash_identifier(email), public_key)
 
 
 def random_id(n):
@@ -104,7 +98,7 @@ numberOfRecords=100
 
 with open('tests/fixtures/shared_modulus.json') as f:
     d = json.load(f)
-encrypt_n=d["n"]
+engine=get_engine(d)
 
 with open('tests/fixtures/public_keys.json') as f:
     d = json.load(f)
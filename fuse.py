@@ -0,0 +1,234 @@
+"""
+FUSE event processor: applies the commutative encryption of the other participants to every data contract.
+"""
+
+import logging
+import time
+import json
+import os
+import duckdb
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import checkpoint
+import commutative
+import partition
+
+from dv_utils import default_settings, Client, ContractManager, LogLevel
+from audit import audit_log
+
+logger = logging.getLogger(__name__)
+
+def get_contract_participant(collaboration_space_id, data_contract):
+    """
+    Return the client id of the participant owning the data contract.
+    """
+    #TODO need to add the client_id in a contract within a collaboration space... to be discussed with the team
+    client=Client()
+    participants=client.get_list_of_participants(collaboration_space_id,None)
+    target_id=data_contract.data_descriptor_id
+    return next(
+        (item["clientId"] for item in participants if "dataDescriptors" in item and any(dd["id"] == target_id for dd in item["dataDescriptors"])),
+        None
+    )
+
+def read_source(con, data_contract, table_index):
+    """
+    Load the source of a data contract in memory and return its number of rows, rows are numbered by their rowid.
+    """
+    query=f"SELECT * FROM {data_contract.connector.get_duckdb_source()}"
+    con.sql("CREATE OR REPLACE TABLE customers_list_" + str(table_index) + " AS "+query)
+    audit_log(f"Read data from: {data_contract.data_descriptor_id}.",LogLevel.INFO)
+    return con.sql("SELECT COUNT(*) FROM customers_list_" + str(table_index)).fetchone()[0]
+
+def snapshot_source(con, data_contract, table_index):
+    """
+    Copy the source of a data contract to the checkpoint location without loading it in memory and return its number of rows.
+    """
+    config_location=default_settings.data_connector_config_location
+    query=f"SELECT * FROM {data_contract.connector.get_duckdb_source()}"
+    checkpoint.write_source(con,config_location,table_index,query)
+    audit_log(f"Read data from: {data_contract.data_descriptor_id}.",LogLevel.INFO)
+    return con.execute("SELECT COUNT(*) FROM read_parquet(?)",[checkpoint.source_path(config_location,table_index)]).fetchone()[0]
+
+def chunk_query(table_index, chunk_index, chunk_size, columns="*"):
+    table="customers_list_" + str(table_index)
+    return f"SELECT {columns} FROM {table} WHERE rowid >= {chunk_index*chunk_size} AND rowid < {(chunk_index+1)*chunk_size} ORDER BY rowid"
+
+def fuse_chunk(con, table_index, chunk_index, chunk_size, participant, public_keys, engine):
+    """
+    Encrypt one chunk of a table and persist it in the checkpoint location.
+    """
+    config_location=default_settings.data_connector_config_location
+    table="customers_list_" + str(table_index)
+    rows=con.sql(chunk_query(table_index,chunk_index,chunk_size,"rowid AS row, customer_email")).fetchall()
+    chunk_ids=pd.DataFrame({
+        "row": pd.Series([row[0] for row in rows], dtype="int64"),
+        "commutative_id": pd.Series([str(commutative.tee_commutative_encrypt(row[1],participant,public_keys,engine)) for row in rows], dtype=object),
+    })
+    con.register("chunk_ids", chunk_ids)
+    query=f"SELECT {table}.*, CAST(chunk_ids.commutative_id AS VARCHAR) AS commutative_id FROM {table} JOIN chunk_ids ON {table}.rowid = chunk_ids.row ORDER BY {table}.rowid"
+    checkpoint.write_chunk(con,config_location,table_index,chunk_index,query)
+    con.unregister("chunk_ids")
+    return len(rows)
+
+def fuse_contracts(con, data_contracts, public_keys, engine, progress, chunk_size):
+    """
+    Fuse every data contract chunk by chunk, resuming from the checkpoint, and export the database once all chunks are done.
+    """
+    config_location=default_settings.data_connector_config_location
+    collaboration_space_id=default_settings.collaboration_space_id
+    for i, data_contract in enumerate(data_contracts):
+        contract_id=data_contract.data_descriptor_id
+        if checkpoint.is_contract_done(progress,contract_id):
+            logger.info(f"| Skip fused contract: {contract_id}")
+            continue
+        con = data_contract.connector.add_duck_db_connection(con)
+        num_rows=read_source(con,data_contract,i)
+        num_chunks=checkpoint.contract_progress(config_location,progress,contract_id,i,num_rows,chunk_size)["chunks"]
+        participant=get_contract_participant(collaboration_space_id,data_contract)
+        for chunk_index in range(num_chunks):
+            if checkpoint.is_chunk_done(progress,contract_id,chunk_index):
+                continue
+            rows=fuse_chunk(con,i,chunk_index,chunk_size,participant,public_keys,engine)
+            checkpoint.complete_chunk(config_location,progress,contract_id,chunk_index,rows)
+            logger.info(f"| Fused chunk {chunk_index+1}/{num_chunks} of: {contract_id}")
+            audit_log(f"Fused chunk {chunk_index} of: {contract_id}.",LogLevel.INFO)
+        audit_log(f"Fused data from: {contract_id}.",LogLevel.INFO)
+
+    #all chunks are done, publish the fused tables
+    con = duckdb.connect(database=":memory:")
+    for i, data_contract in enumerate(data_contracts):
+        contract=progress["contracts"][data_contract.data_descriptor_id]
+        chunks=[checkpoint.chunk_path(config_location,i,chunk_index) for chunk_index in range(contract["chunks"])]
+        con.execute("CREATE OR REPLACE TABLE customers_list_" + str(i) + " AS SELECT * FROM read_parquet(?)",[chunks])
+    #check if tables exist in memory
+    existing_tables=con.sql("SHOW ALL TABLES; ")
+    if len(existing_tables)>0:
+        con.sql("EXPORT DATABASE '"+config_location+"' (FORMAT PARQUET);")
+        #the exported database replaces the output of a previous partitioned fusion
+        partition.reset_partitions(config_location)
+        logger.info(f"| Database has  been created                            |")
+        logger.info(f"|                                                       |")
+
+def partitioned_fuse(evt: dict, con, data_contracts, public_keys, engine, progress, chunk_size, num_partitions):
+    """
+    Fuse all data contracts in hash partitions of the commutative_id.
+    Each source is copied to a snapshot file and split in chunks encrypted by independent worker processes,
+    every worker reads its own rows from the snapshot and writes them to the bucket of their commutative_id (see partition.py).
+    Buckets are written in the checkpoint location and published once all chunks are done,
+    the staged partitions and their manifest are swapped in together so that publishing can be repeated.
+    """
+    config_location=default_settings.data_connector_config_location
+    staging=checkpoint.checkpoint_location(config_location)
+    num_workers=int(evt.get("workers", os.cpu_count() or 1))
+    collaboration_space_id=default_settings.collaboration_space_id
+
+    logger.info(f"| 3. Start partitioned fusing process                   |")
+    logger.info(f"|    partitions: {num_partitions}, workers: {num_workers}")
+    logger.info(f"|                                                       |")
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        futures={}
+        for i, data_contract in enumerate(data_contracts):
+            contract_id=data_contract.data_descriptor_id
+            if checkpoint.is_contract_done(progress,contract_id):
+                logger.info(f"| Skip fused contract: {contract_id}")
+                continue
+            con = data_contract.connector.add_duck_db_connection(con)
+            num_rows=snapshot_source(con,data_contract,i)
+            num_chunks=checkpoint.contract_progress(config_location,progress,contract_id,i,num_rows,chunk_size)["chunks"]
+            participant=get_contract_participant(collaboration_space_id,data_contract)
+            source=checkpoint.source_path(config_location,i)
+            for chunk_index in range(num_chunks):
+                if checkpoint.is_chunk_done(progress,contract_id,chunk_index):
+                    continue
+                futures[executor.submit(partition.encrypt_chunk_worker,staging,i,chunk_index,source,chunk_index*chunk_size,chunk_size,participant,public_keys,engine,num_partitions)]=(contract_id,chunk_index)
+        #every chunk that succeeded is kept, even when another one failed
+        failures=[]
+        for future in as_completed(futures):
+            contract_id, chunk_index=futures[future]
+            try:
+                counts=future.result()
+            except Exception as e:
+                logger.error(f"| Chunk {chunk_index} of {contract_id} failed: {e}")
+                failures.append(e)
+                continue
+            checkpoint.complete_chunk(config_location,progress,contract_id,chunk_index,counts)
+            audit_log(f"Fused chunk {chunk_index} of: {contract_id}.",LogLevel.INFO)
+        if len(failures)>0:
+            raise failures[0]
+
+    #all chunks are done, publish the partitions
+    publish_partitions(config_location,staging,progress,len(data_contracts),num_partitions)
+    logger.info(f"| Partitions have been created                          |")
+    logger.info(f"|                                                       |")
+
+def publish_partitions(config_location, staging, progress, num_tables, num_partitions):
+    """
+    Swap the staged partitions in, with their manifest. The staged partitions only disappear once they are
+    published, a FUSE re-sent after the swap keeps the published ones.
+    """
+    staged=partition.partitions_location(staging)
+    if not os.path.exists(staged) and partition.load_manifest(config_location) != None:
+        logger.info(f"| Partitions already published                          |")
+        return
+    bucket_rows=[0]*num_partitions
+    for contract in progress["contracts"].values():
+        for counts in contract["completed"].values():
+            for bucket, count in counts.items():
+                bucket_rows[int(bucket)]+=count
+    manifest={}
+    manifest["partitions"]=num_partitions
+    manifest["tables"]=num_tables
+    manifest["bucket_rows"]=bucket_rows
+    partition.write_manifest(staging,manifest)
+    partition.reset_partitions(config_location)
+    os.replace(staged,partition.partitions_location(config_location))
+
+def fuse_event_processor(evt: dict):
+    logger.info(f"---------------------------------------------------------")
+    logger.info(f"|                    START PROCESSING                   |")
+    logger.info(f"|                                                       |")
+    start_time = time.time()
+    logger.info(f"|    Start time:  {start_time} secs               |")
+    logger.info(f"|                                                       |")
+    audit_log(f"Start processing event: {evt.get('type', '')}.",LogLevel.INFO)
+    try:
+        logger.info(f"| 2. Load keys                                          |")
+        logger.info(f"|                                                       |")
+        config_location=default_settings.data_connector_config_location
+        engine = commutative.load_engine(config_location)
+        with open(config_location+'/public_keys.json') as f:
+            public_keys = json.load(f)
+
+        logger.info(f"| 2. Get data contracts                                 |")
+        logger.info(f"|                                                       |")
+
+        #Connect in memory duckdb (encrypted memory on confidential computing)
+        con = duckdb.connect(database=":memory:")
+
+        collaboration_space_id=default_settings.collaboration_space_id
+        contractManager=ContractManager()
+        data_contracts=contractManager.get_contracts_for_collaboration_space(collaboration_space_id)
+        if data_contracts != None and len(data_contracts)>0:
+            num_partitions=int(evt.get("partitions", 0))
+            chunk_size=int(evt.get("chunk_size", checkpoint.CHUNK_SIZE))
+            #resume from the last completed chunk of a previous FUSE with the same inputs
+            fingerprint=checkpoint.fingerprint(public_keys,[data_contract.data_descriptor_id for data_contract in data_contracts],chunk_size,num_partitions)
+            progress=checkpoint.load_progress(config_location,fingerprint)
+            if num_partitions>1:
+                partitioned_fuse(evt,con,data_contracts,public_keys,engine,progress,chunk_size,num_partitions)
+            else:
+                logger.info(f"| 3. Start fusing process                               |")
+                logger.info(f"|                                                       |")
+                fuse_contracts(con,data_contracts,public_keys,engine,progress,chunk_size)
+            checkpoint.clear(config_location)
+            execution_time=(time.time() - start_time)
+            logger.info(f"|    Execution time:  {execution_time} secs           |")
+            logger.info(f"|                                                       |")
+            logger.info(f"--------------------------------------------------------")
+        else:
+            logger.error(f"No data contract available for collaboration_space_id: {collaboration_space_id}")
+    except Exception as e:
+        logger.error(e)
+        logger.error(f"FUSE interrupted, completed chunks are kept in {checkpoint.checkpoint_location(default_settings.data_connector_config_location)}, send a new FUSE event to resume")
@@ -0,0 +1,77 @@
+"""
+INITIALIZE event processor: generates the commutative encryption keys of every participant.
+"""
+
+import logging
+import time
+import json
+
+import commutative
+
+from dv_utils import default_settings, Client, LogLevel
+from audit import audit_log
+
+logger = logging.getLogger(__name__)
+
+# TEE generates and distributes keys
+def tee_initialize(participants_ids, engine_name=commutative.DEFAULT_ENGINE):
+    """
+    TEE generates keys for each company and shares the engine parameters and public keys.
+    """
+    shared, keys = commutative.generate_key_material(engine_name,len(participants_ids))
+    public_keys = {}
+    i=0
+    for participant in participants_ids:
+       # _, public_key = generate_commutative_key(phi)  # Generate public key
+        public_keys[participant] = keys[i]
+        i=i+1
+    return shared, public_keys  # Only public keys are shared
+
+def initialize_event_processor(evt: dict):
+    logger.info(f"---------------------------------------------------------")
+    logger.info(f"|                    START PROCESSING                   |")
+    logger.info(f"|                                                       |")
+    start_time = time.time()
+    logger.info(f"|    Start time:  {start_time} secs               |")
+    logger.info(f"|                                                       |")
+    audit_log(f"Start processing event: {evt.get('type', '')}.",LogLevel.INFO)
+    try:
+        collaboration_space_id=default_settings.collaboration_space_id
+        logger.info(f"| 1. Get participants                                   |")
+        logger.info(f"|                                                       |")
+        client=Client()
+        participants=client.get_list_of_participants(collaboration_space_id,None)
+        if participants != None and len(participants)>0:
+            participants_ids=[]
+            #get all participants with role != code provider
+            for participant in participants:
+                if participant["role"]!="CodeProvider":
+                    participants_ids.append(participant["clientId"])
+            logger.info(f"| 2. Initialize keys                                    |")
+            logger.info(f"|                                                       |")
+            engine_name=evt.get("engine", commutative.DEFAULT_ENGINE)
+            shared, public_keys = tee_initialize(participants_ids,engine_name)
+            engine=commutative.get_engine(shared)
+            #store public keys and engine parameters (n for modexp) for each participants
+            for participant_id in participants_ids:
+                public_key=engine.public_parameters()
+                public_key["public-key"]=public_keys[participant_id]
+                with open(default_settings.data_user_output_location+'/'+participant_id+'_keys.json', 'w', newline='') as file:
+                    file.write(json.dumps(public_key, indent=4))
+            
+            #store shared modulus (and selected engine) in secret store 
+            with open(default_settings.data_connector_config_location+'/shared_modulus.json', 'w', newline='') as file:
+                file.write(json.dumps(shared, indent=4))
+            #store all public keys in secret store
+            with open(default_settings.data_connector_config_location+'/public_keys.json', 'w', newline='') as file:
+                file.write(json.dumps(public_keys, indent=4))
+
+            logger.info(f"|                                                       |")
+            execution_time=(time.time() - start_time)
+            logger.info(f"|    Execution time:  {execution_time} secs           |")
+            logger.info(f"|                                                       |")
+            logger.info(f"--------------------------------------------------------")
+        else:
+            logger.error(f"No participants available for collaboration_space_id: {collaboration_space_id}")
+    except Exception as e:
+        logger.error(e)
@@ -0,0 +1,179 @@
+"""
+Partitioned execution of the fusion and intersection steps.
+
+Rows are bucketed by a hash of the join key (the commutative_id) so that equal ids
+from every data holder always land in the same bucket. Each bucket can then be
+intersected on its own, by a worker process today and by a separate cage instance later:
+workers only exchange parquet files in a shared location and JSON-serializable results,
+never in-memory state.
+
+Layout of a partitioned fusion in the config location:
+
+    partitions/partitions.json                                  manifest written by the coordinator
+    partitions/bucket_<k>/customers_list_<i>-<chunk>.parquet    rows of table i hashed into bucket k
+"""
+
+import os
+import glob
+import json
+import shutil
+from hashlib import sha256
+
+import duckdb
+
+from commutative import tee_commutative_encrypt
+
+PARTITIONS_DIRECTORY = "partitions"
+PARTITIONS_MANIFEST = "partitions.json"
+
+
+def partition_of(commutative_id, num_partitions):
+    """
+    Return the bucket of a join key. The hash is stable across processes and machines.
+    """
+    digest = sha256(str(commutative_id).encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % num_partitions
+
+
+def partitions_location(config_location):
+    return config_location + "/" + PARTITIONS_DIRECTORY
+
+
+def bucket_location(config_location, bucket):
+    return partitions_location(config_location) + "/bucket_" + str(bucket)
+
+
+def reset_partitions(config_location):
+    """
+    Remove the output of a previous partitioned fusion.
+    """
+    shutil.rmtree(partitions_location(config_location), ignore_errors=True)
+
+
+def write_manifest(config_location, manifest):
+    os.makedirs(partitions_location(config_location), exist_ok=True)
+    with open(partitions_location(config_location) + "/" + PARTITIONS_MANIFEST, "w", newline="") as file:
+        file.write(json.dumps(manifest, indent=4))
+
+
+def load_manifest(config_location):
+    """
+    Return the manifest of the partitioned fusion, or None if the last fusion was not partitioned.
+    """
+    path = partitions_location(config_location) + "/" + PARTITIONS_MANIFEST
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def read_slice(con, name, path, offset, limit, exclude=None):
+    """
+    Create a view of the rows [offset, offset+limit) of a parquet file, numbered by their file_row_number.
+    """
+    columns = "* EXCLUDE (" + ", ".join(exclude) + ")" if exclude else "*"
+    con.sql(
+        "CREATE OR REPLACE VIEW " + name + " AS SELECT " + columns + " FROM read_parquet('" + path + "', file_row_number=true)"
+        " WHERE file_row_number >= " + str(offset) + " AND file_row_number < " + str(offset + limit)
+    )
+
+
+def encrypt_chunk_worker(config_location, table_index, chunk_index, source, offset, limit, participant, public_keys, engine, num_partitions):
+    """
+    Encrypt one chunk of a data holder table, read from its slice of the source file, and write its rows
+    to the bucket of their commutative_id. Returns the number of rows written per bucket.
+    """
+    con = duckdb.connect(database=":memory:")
+    read_slice(con, "chunk", source, offset, limit)
+    rows = con.sql("SELECT file_row_number, customer_email FROM chunk ORDER BY file_row_number").fetchall()
+    commutative_ids = [str(tee_commutative_encrypt(value, participant, public_keys, engine)) for _, value in rows]
+    counts = write_buckets(con, config_location, table_index, chunk_index, "chunk", [row for row, _ in rows], commutative_ids, num_partitions)
+    con.close()
+    return counts
+
+
+def write_buckets(con, config_location, table_index, chunk_index, table, rows, commutative_ids, num_partitions):
+    """
+    Write the rows of a table, numbered by their file_row_number, with their commutative_id to the bucket of the commutative_id.
+    The columns of the table are written as they are typed. Returns the number of rows written per bucket.
+    """
+    buckets = [partition_of(value, num_partitions) for value in commutative_ids]
+    con.execute(
+        "CREATE OR REPLACE TEMP TABLE chunk_ids AS SELECT UNNEST(?::BIGINT[]) AS row, UNNEST(?::VARCHAR[]) AS commutative_id, UNNEST(?::INTEGER[]) AS bucket",
+        [rows, commutative_ids, buckets],
+    )
+
+    counts = {}
+    for bucket in sorted(set(buckets)):
+        os.makedirs(bucket_location(config_location, bucket), exist_ok=True)
+        path = bucket_location(config_location, bucket) + "/customers_list_" + str(table_index) + "-" + str(chunk_index) + ".parquet"
+        query = (
+            "SELECT " + table + ".* EXCLUDE (file_row_number), chunk_ids.commutative_id FROM " + table
+            + " JOIN chunk_ids ON " + table + ".file_row_number = chunk_ids.row WHERE chunk_ids.bucket = " + str(bucket)
+            + " ORDER BY " + table + ".file_row_number"
+        )
+        con.sql("COPY (" + query + ") TO '" + path + "' (FORMAT PARQUET)")
+        counts[bucket] = buckets.count(bucket)
+    con.sql("DROP TABLE chunk_ids")
+    return counts
+
+
+def intersect_bucket_worker(config_location, bucket, num_tables):
+    """
+    Intersect all tables of one bucket.
+    Returns the number of rows per table and the overlap matrix of the bucket,
+    where overlap[i][j] is the number of matching commutative_id between table i and table j.
+    """
+    con = duckdb.connect(database=":memory:")
+    rows = [0] * num_tables
+    available = []
+    for i in range(num_tables):
+        pattern = bucket_location(config_location, bucket) + "/customers_list_" + str(i) + "-*.parquet"
+        if len(glob.glob(pattern)) > 0:
+            con.sql("CREATE VIEW customers_list_" + str(i) + " AS SELECT * FROM read_parquet('" + pattern + "')")
+            rows[i] = con.sql("SELECT COUNT(*) FROM customers_list_" + str(i)).fetchone()[0]
+            available.append(i)
+
+    overlap = [[0] * num_tables for _ in range(num_tables)]
+    for i in available:
+        overlap[i][i] = rows[i]
+        for j in available:
+            if j > i:
+                query = "SELECT COUNT(*) FROM customers_list_" + str(i) + ",customers_list_" + str(j) + " WHERE (customers_list_" + str(i) + ".commutative_id=customers_list_" + str(j) + ".commutative_id)"
+                total = con.sql(query).fetchone()[0]
+                overlap[i][j] = total
+                overlap[j][i] = total
+    con.close()
+    return {"bucket": bucket, "rows": rows, "overlap": overlap}
+
+
+def merge_bucket_results(results, num_tables):
+    """
+    Merge the per-bucket results of intersect_bucket_worker into the totals of the whole dataset.
+    """
+    rows = [0] * num_tables
+    overlap = [[0] * num_tables for _ in range(num_tables)]
+    for result in results:
+        for i in range(num_tables):
+            rows[i] += result["rows"][i]
+            for j in range(num_tables):
+                overlap[i][j] += result["overlap"][i][j]
+    return {"rows": rows, "overlap": overlap}
+
+
+def lookup_commutative_id(config_location, commutative_id, num_partitions, num_tables):
+    """
+    Return, for each table, whether the commutative_id is present. Only its bucket is read.
+    """
+    bucket = partition_of(commutative_id, num_partitions)
+    con = duckdb.connect(database=":memory:")
+    found = []
+    for i in range(num_tables):
+        pattern = bucket_location(config_location, bucket) + "/customers_list_" + str(i) + "-*.parquet"
+        if len(glob.glob(pattern)) == 0:
+            found.append(False)
+            continue
+        total = con.execute("SELECT COUNT(*) FROM read_parquet('" + pattern + "') WHERE commutative_id = ?", [str(commutative_id)]).fetchone()[0]
+        found.append(total > 0)
+    con.close()
+    return found
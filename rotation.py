@@ -0,0 +1,241 @@
+"""
+ROTATE_KEYS event processor: moves the fused data to a new generation of participant keys.
+
+Every fused id is x^(d_1*...*d_k) (modexp) or (k_1*...*k_k)*P (ristretto255). With the shared
+parameters kept in the TEE, the per-participant deltas d_i'/d_i combine into a single rotation
+exponent, so every stored commutative_id is moved to the new keys with one exponentiation and
+the sources are neither downloaded nor decrypted again. The modexp modulus n is kept.
+
+The new generation is written batch by batch in worker processes to staging directories on the
+same filesystem as their targets: the config location, and the output location for the
+participant key files (usually a separate mount), so that every swap is an atomic rename.
+Once complete, a journal listing the files to swap is written atomically and the swap is
+replayed from the journal, so that a rotation interrupted during its swap is completed before
+the next event reads the key material.
+"""
+
+import logging
+import time
+import json
+import os
+import re
+import glob
+import shutil
+import duckdb
+from concurrent.futures import ProcessPoolExecutor
+
+import commutative
+import partition
+
+from dv_utils import default_settings, LogLevel
+from audit import audit_log
+
+logger = logging.getLogger(__name__)
+
+ROTATION_STAGING = "rotation"
+ROTATION_JOURNAL = "rotation.json"
+BATCH_SIZE = 10000
+
+
+def staging_location(config_location):
+    return config_location + "/" + ROTATION_STAGING
+
+
+def exported_table_files(config_location):
+    """
+    Return the parquet files of the database exported by FUSE (names are chosen by duckdb, see load.sql).
+    """
+    path = config_location + "/load.sql"
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return [os.path.basename(file) for file in re.findall(r"FROM '([^']+\.parquet)'", f.read())]
+
+
+def count_rows(path):
+    con = duckdb.connect(database=":memory:")
+    total = con.execute("SELECT COUNT(*) FROM read_parquet(?)", [path]).fetchone()[0]
+    con.close()
+    return total
+
+
+def read_ids(path, offset, limit):
+    """
+    Return the row number and commutative_id of a batch of rows, other columns are never read.
+    """
+    con = duckdb.connect(database=":memory:")
+    rows = con.execute(
+        "SELECT file_row_number, commutative_id FROM read_parquet(?, file_row_number=true) WHERE file_row_number >= ? AND file_row_number < ? ORDER BY file_row_number",
+        [path, offset, offset + limit],
+    ).fetchall()
+    con.close()
+    return rows
+
+
+def rotate_table_batch_worker(source, offset, limit, output, engine, rotation_key):
+    """
+    Rotate the commutative_id of one batch of an exported table and write them, with their row number, to a part file.
+    """
+    rows = read_ids(source, offset, limit)
+    con = duckdb.connect(database=":memory:")
+    con.execute(
+        "COPY (SELECT UNNEST(?::BIGINT[]) AS row, UNNEST(?::VARCHAR[]) AS commutative_id) TO '" + output + "' (FORMAT PARQUET)",
+        [[row for row, _ in rows], [str(engine.encrypt(value, rotation_key)) for _, value in rows]],
+    )
+    con.close()
+    return len(rows)
+
+
+def rotate_partition_batch_worker(source, offset, limit, staging, table_index, chunk_index, engine, rotation_key, num_partitions):
+    """
+    Rotate one batch of a bucket file. The commutative_id changes, so rows are written to their new bucket.
+    """
+    rows = read_ids(source, offset, limit)
+    con = duckdb.connect(database=":memory:")
+    partition.read_slice(con, "batch", source, offset, limit, exclude=["commutative_id"])
+    commutative_ids = [str(engine.encrypt(value, rotation_key)) for _, value in rows]
+    counts = partition.write_buckets(con, staging, table_index, chunk_index, "batch", [row for row, _ in rows], commutative_ids, num_partitions)
+    con.close()
+    return counts
+
+
+def batches(path, batch_size):
+    total = count_rows(path)
+    return [(offset, min(batch_size, total - offset)) for offset in range(0, total, batch_size)]
+
+
+def write_json(path, content):
+    """
+    Write a json file atomically.
+    """
+    with open(path + ".tmp", "w", newline="") as file:
+        file.write(json.dumps(content, indent=4))
+    os.replace(path + ".tmp", path)
+
+
+def complete_pending_rotation(config_location):
+    """
+    Replay the swap of a committed rotation. Returns True if a rotation was completed.
+    """
+    journal_path = config_location + "/" + ROTATION_JOURNAL
+    if not os.path.exists(journal_path):
+        return False
+    with open(journal_path) as f:
+        journal = json.load(f)
+    for staged, target in journal["swap"]:
+        if not os.path.exists(staged):
+            # already swapped before an interruption
+            continue
+        if os.path.isdir(staged):
+            shutil.rmtree(target, ignore_errors=True)
+        os.replace(staged, target)
+    for staging in journal.get("staging", [staging_location(config_location)]):
+        shutil.rmtree(staging, ignore_errors=True)
+    os.remove(journal_path)
+    logger.info(f"Key generation {journal['generation']} has been swapped in")
+    return True
+
+
+def rotate_keys_event_processor(evt: dict):
+    logger.info(f"---------------------------------------------------------")
+    logger.info(f"|                    START PROCESSING                   |")
+    logger.info(f"|                                                       |")
+    start_time = time.time()
+    logger.info(f"|    Start time:  {start_time} secs               |")
+    logger.info(f"|                                                       |")
+    audit_log(f"Start processing event: {evt.get('type', '')}.",LogLevel.INFO)
+    try:
+        config_location=default_settings.data_connector_config_location
+        complete_pending_rotation(config_location)
+        #a staging directory without journal is an interrupted rotation, start over
+        staging=staging_location(config_location)
+        output_staging=staging_location(default_settings.data_user_output_location)
+        for location in (staging, output_staging):
+            shutil.rmtree(location, ignore_errors=True)
+            os.makedirs(location)
+
+        logger.info(f"| 1. Load keys                                          |")
+        logger.info(f"|                                                       |")
+        with open(config_location+'/shared_modulus.json') as f:
+            shared = json.load(f)
+        engine=commutative.get_engine(shared)
+        with open(config_location+'/public_keys.json') as f:
+            public_keys = json.load(f)
+
+        logger.info(f"| 2. Generate new keys under the current modulus        |")
+        logger.info(f"|                                                       |")
+        participants_ids=list(public_keys)
+        new_keys=engine.rotate_keys(shared,len(participants_ids))
+        new_public_keys=dict(zip(participants_ids,new_keys))
+        rotation_key=engine.rotation_key(shared,[public_keys[participant_id] for participant_id in participants_ids],new_keys)
+
+        logger.info(f"| 3. Rotate fused tables                                |")
+        logger.info(f"|                                                       |")
+        batch_size=int(evt.get("batch_size", BATCH_SIZE))
+        num_workers=int(evt.get("workers", os.cpu_count() or 1))
+        swap=[]
+        with ProcessPoolExecutor(max_workers=num_workers) as executor:
+            #database exported by FUSE
+            for file in exported_table_files(config_location):
+                source=config_location+"/"+file
+                parts=[]
+                futures=[]
+                for k, (offset, limit) in enumerate(batches(source,batch_size)):
+                    parts.append(staging+"/"+file+".part"+str(k))
+                    futures.append(executor.submit(rotate_table_batch_worker,source,offset,limit,parts[-1],engine,rotation_key))
+                for k, future in enumerate(futures):
+                    future.result()
+                    audit_log(f"Rotated batch {k} of: {file}.",LogLevel.INFO)
+                con = duckdb.connect(database=":memory:")
+                if len(parts)>0:
+                    #only the commutative_id is replaced, the other columns keep their values and types
+                    query="SELECT src.* EXCLUDE (file_row_number) REPLACE (rotated.commutative_id AS commutative_id) FROM read_parquet(?, file_row_number=true) AS src JOIN read_parquet(?) AS rotated ON src.file_row_number = rotated.row ORDER BY src.file_row_number"
+                    con.execute("COPY ("+query+") TO '"+staging+"/"+file+"' (FORMAT PARQUET)",[source,parts])
+                else:
+                    #empty table, keep its schema
+                    con.execute("COPY (SELECT * FROM read_parquet(?)) TO '"+staging+"/"+file+"' (FORMAT PARQUET)",[source])
+                con.close()
+                for part in parts:
+                    os.remove(part)
+                swap.append([staging+"/"+file,source])
+
+            #partitioned fusion, rows move to the bucket of their new commutative_id
+            manifest=partition.load_manifest(config_location)
+            if manifest != None:
+                num_partitions=manifest["partitions"]
+                bucket_rows=[0]*num_partitions
+                futures={}
+                for bucket in range(num_partitions):
+                    for source in sorted(glob.glob(partition.bucket_location(config_location,bucket)+"/customers_list_*.parquet")):
+                        table_index, chunk_index=re.match(r"customers_list_(\d+)-(.+)\.parquet",os.path.basename(source)).groups()
+                        for k, (offset, limit) in enumerate(batches(source,batch_size)):
+                            futures[executor.submit(rotate_partition_batch_worker,source,offset,limit,staging,table_index,str(bucket)+"."+chunk_index+"."+str(k),engine,rotation_key,num_partitions)]=(bucket,k)
+                for future, (bucket, k) in futures.items():
+                    for new_bucket, count in future.result().items():
+                        bucket_rows[new_bucket]+=count
+                    audit_log(f"Rotated batch {k} of partition {bucket}.",LogLevel.INFO)
+                manifest["bucket_rows"]=bucket_rows
+                partition.write_manifest(staging,manifest)
+                swap.append([partition.partitions_location(staging),partition.partitions_location(config_location)])
+
+        logger.info(f"| 4. Swap in the new key generation                     |")
+        logger.info(f"|                                                       |")
+        write_json(staging+"/public_keys.json",new_public_keys)
+        swap.append([staging+"/public_keys.json",config_location+"/public_keys.json"])
+        for participant_id in participants_ids:
+            public_key=engine.public_parameters()
+            public_key["public-key"]=new_public_keys[participant_id]
+            write_json(output_staging+"/"+participant_id+"_keys.json",public_key)
+            swap.append([output_staging+"/"+participant_id+"_keys.json",default_settings.data_user_output_location+'/'+participant_id+'_keys.json'])
+        #commit point: once the journal exists the new generation is swapped in, even after an interruption
+        write_json(config_location+"/"+ROTATION_JOURNAL,{"generation":start_time,"swap":swap,"staging":[staging,output_staging]})
+        complete_pending_rotation(config_location)
+        audit_log(f"New key generation has been swapped in.",LogLevel.INFO)
+
+        logger.info(f"|                                                       |")
+        execution_time=(time.time() - start_time)
+        logger.info(f"|    Execution time:  {execution_time} secs           |")
+        logger.info(f"|                                                       |")
+        logger.info(f"--------------------------------------------------------")
+    except Exception as e:
+        logger.error(e)
@@ -4,6 +4,11 @@ collection of tests for the project
 import logging
 
 from . import test_process
+from . import test_checkpoint
+from . import test_rotation
+from . import test_audit
+from . import test_commutative
+from . import test_partition
 
 logging.basicConfig(
     level="DEBUG",
@@ -0,0 +1,80 @@
+"""
+Unit test of the buffered audit log sink.
+"""
+
+import threading
+import time
+import unittest
+
+from dv_utils import LogLevel
+
+from audit import BufferedAuditSink
+
+
+class Test(unittest.TestCase):
+    def test_flush_writes_in_batches(self):
+        """
+        Records are written in batches of at most batch_size and all of them are out after flush
+        """
+        batches = []
+        sink = BufferedAuditSink(writer=batches.append, batch_size=10)
+        for i in range(95):
+            sink.log(f"Fused chunk {i}.", LogLevel.INFO)
+        sink.flush()
+        self.assertEqual([body["msg"] for batch in batches for _, body in batch], [f"Fused chunk {i}." for i in range(95)])
+        self.assertTrue(all(len(batch) <= 10 for batch in batches))
+        sink.close()
+
+    def test_full_queue_blocks_without_losing_records(self):
+        """
+        A slow writer fills the bounded queue, the caller waits and nothing is dropped on close
+        """
+        release = threading.Event()
+        written = []
+
+        def slow_writer(batch):
+            release.wait()
+            written.extend(batch)
+
+        sink = BufferedAuditSink(writer=slow_writer, max_queue_size=5, batch_size=2)
+        producer = threading.Thread(target=lambda: [sink.log(f"record {i}") for i in range(20)])
+        producer.start()
+        producer.join(timeout=0.5)
+        self.assertTrue(producer.is_alive())
+        release.set()
+        producer.join()
+        sink.close()
+        self.assertEqual(len(written), 20)
+
+    def test_failing_writer_does_not_stop_the_sink(self):
+        def failing_writer(batch):
+            raise ConnectionError("log sink unavailable")
+
+        sink = BufferedAuditSink(writer=failing_writer)
+        with self.assertLogs("audit", level="ERROR"):
+            sink.log("Start processing event: FUSE.")
+            sink.flush()
+        self.assertTrue(sink.thread.is_alive())
+        sink.close()
+
+    def test_records_are_timestamped_when_enqueued(self):
+        """
+        The background thread writes records later, their timestamps are the ones of the caller
+        """
+        release = threading.Event()
+        written = []
+
+        def slow_writer(batch):
+            release.wait()
+            written.extend(batch)
+
+        sink = BufferedAuditSink(writer=slow_writer)
+        enqueued = time.time_ns()
+        sink.log("Fused chunk 0.", LogLevel.INFO)
+        time.sleep(0.2)
+        release.set()
+        sink.close()
+        header, body = written[0]
+        self.assertEqual(body["level"], "INFO")
+        self.assertLess(body["timestamp"] - enqueued, 100_000_000)
+        self.assertTrue(header.endswith(" - AUDIT - "))
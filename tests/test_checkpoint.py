@@ -0,0 +1,231 @@
+"""
+Unit test of the checkpointed, resumable FUSE.
+"""
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import duckdb
+
+import checkpoint
+import commutative
+import fuse
+import partition
+from dv_utils import default_settings
+
+
+encrypt_chunk_worker = partition.encrypt_chunk_worker
+
+
+def failing_encrypt_chunk_worker(config_location, table_index, chunk_index, *args):
+    """
+    Worker failing on the first chunk while a marker file exists, it runs in another process
+    """
+    if (table_index, chunk_index) == (0, 0) and os.path.exists(config_location + "/fail"):
+        raise MemoryError("worker killed")
+    return encrypt_chunk_worker(config_location, table_index, chunk_index, *args)
+
+
+class ParquetConnector:
+    """
+    Connector of a local parquet file, in place of the connectors of the data contracts
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def add_duck_db_connection(self, con):
+        return con
+
+    def get_duckdb_source(self):
+        return "read_parquet('" + self.path + "')"
+
+
+class DataContract:
+    def __init__(self, data_descriptor_id, path):
+        self.data_descriptor_id = data_descriptor_id
+        self.connector = ParquetConnector(path)
+
+
+class Test(unittest.TestCase):
+    def setUp(self):
+        self.config_location = tempfile.mkdtemp()
+        self.data_location = tempfile.mkdtemp()
+        shutil.copy('tests/fixtures/shared_modulus.json', self.config_location)
+        shutil.copy('tests/fixtures/public_keys.json', self.config_location)
+        self.engine = commutative.load_engine(self.config_location)
+        with open(self.config_location + '/public_keys.json') as f:
+            self.public_keys = json.load(f)
+        self.participants = ["66e1a579eb0cbee048a2bd04", "66e1a4eaeb0cbee048a2bcf3"]
+        self.data_contracts = []
+        for i, values in enumerate([range(2, 12), range(7, 17)]):
+            path = self.data_location + "/customers-list" + str(i) + ".parquet"
+            emails = [str(self.engine.encrypt(value, self.public_keys[self.participants[i]])) for value in values]
+            con = duckdb.connect(database=":memory:")
+            con.execute("COPY (SELECT UNNEST(?) AS customer_id, UNNEST(?) AS customer_email) TO '" + path + "' (FORMAT PARQUET)", [list(values), emails])
+            con.close()
+            self.data_contracts.append(DataContract("contract" + str(i), path))
+        self.patches = [
+            mock.patch.object(default_settings, "data_connector_config_location", self.config_location),
+            mock.patch.object(fuse, "get_contract_participant", lambda collaboration_space_id, data_contract: self.participants[self.data_contracts.index(data_contract)]),
+        ]
+        for patch in self.patches:
+            patch.start()
+
+    def tearDown(self):
+        for patch in self.patches:
+            patch.stop()
+        shutil.rmtree(self.config_location)
+        shutil.rmtree(self.data_location)
+
+    def progress(self, num_partitions=0):
+        fingerprint = checkpoint.fingerprint(self.public_keys, ["contract0", "contract1"], 4, num_partitions)
+        return checkpoint.load_progress(self.config_location, fingerprint)
+
+    def common_customers(self):
+        con = duckdb.connect(database=":memory:")
+        con.sql("IMPORT DATABASE '" + self.config_location + "'")
+        return con.sql("SELECT COUNT(*) FROM customers_list_0,customers_list_1 WHERE (customers_list_0.commutative_id=customers_list_1.commutative_id)").fetchone()[0]
+
+    def test_resume_after_crash(self):
+        """
+        A crash in the second contract keeps the completed chunks, the next FUSE only computes the missing ones
+        """
+        fuse_chunk = fuse.fuse_chunk
+        calls = []
+        crashed = []
+
+        def crashing_fuse_chunk(con, table_index, chunk_index, *args):
+            if (table_index, chunk_index) == (1, 1) and not crashed:
+                crashed.append(True)
+                raise MemoryError("cage restarted")
+            calls.append((table_index, chunk_index))
+            return fuse_chunk(con, table_index, chunk_index, *args)
+
+        with mock.patch.object(fuse, "fuse_chunk", crashing_fuse_chunk):
+            with self.assertRaises(MemoryError):
+                fuse.fuse_contracts(duckdb.connect(database=":memory:"), self.data_contracts, self.public_keys, self.engine, self.progress(), 4)
+            self.assertFalse(os.path.exists(self.config_location + "/load.sql"))
+            progress = self.progress()
+            self.assertTrue(checkpoint.is_contract_done(progress, "contract0"))
+            self.assertEqual(list(progress["contracts"]["contract1"]["completed"]), ["0"])
+
+            fuse.fuse_contracts(duckdb.connect(database=":memory:"), self.data_contracts, self.public_keys, self.engine, progress, 4)
+        self.assertEqual(calls, [(0, 0), (0, 1), (0, 2), (1, 0), (1, 1), (1, 2)])
+        self.assertEqual(self.common_customers(), 5)
+
+    def write_source(self, i, values):
+        path = self.data_contracts[i].connector.path
+        emails = [str(self.engine.encrypt(value, self.public_keys[self.participants[i]])) for value in values]
+        con = duckdb.connect(database=":memory:")
+        con.execute("COPY (SELECT UNNEST(?) AS customer_id, UNNEST(?) AS customer_email) TO '" + path + "' (FORMAT PARQUET)", [list(values), emails])
+        con.close()
+
+    def test_resume_after_source_changed(self):
+        """
+        A source that grew or shrank since the crash is fused again, the published table has all its current rows
+        """
+        for values in [range(7, 21), range(7, 12)]:
+            fuse_chunk = fuse.fuse_chunk
+            crashed = []
+
+            def crashing_fuse_chunk(con, table_index, chunk_index, *args):
+                if (table_index, chunk_index) == (1, 1) and not crashed:
+                    crashed.append(True)
+                    raise MemoryError("cage restarted")
+                return fuse_chunk(con, table_index, chunk_index, *args)
+
+            self.write_source(1, range(7, 17))
+            with mock.patch.object(fuse, "fuse_chunk", crashing_fuse_chunk):
+                with self.assertRaises(MemoryError):
+                    fuse.fuse_contracts(duckdb.connect(database=":memory:"), self.data_contracts, self.public_keys, self.engine, self.progress(), 4)
+            self.write_source(1, values)
+            fuse.fuse_contracts(duckdb.connect(database=":memory:"), self.data_contracts, self.public_keys, self.engine, self.progress(), 4)
+            con = duckdb.connect(database=":memory:")
+            con.sql("IMPORT DATABASE '" + self.config_location + "'")
+            self.assertEqual(con.sql("SELECT customer_id FROM customers_list_1 ORDER BY customer_id").fetchall(), [(value,) for value in values])
+            checkpoint.clear(self.config_location)
+
+    def test_progress_is_discarded_when_inputs_change(self):
+        progress = self.progress()
+        checkpoint.contract_progress(self.config_location, progress, "contract0", 0, 10, 4)
+        checkpoint.complete_chunk(self.config_location, progress, "contract0", 0, 4)
+        self.assertTrue(checkpoint.is_chunk_done(self.progress(), "contract0", 0))
+        self.assertFalse(checkpoint.is_chunk_done(self.progress(num_partitions=4), "contract0", 0))
+
+    def test_partitioned_fuse_is_published_when_complete(self):
+        num_partitions = 3
+        progress = self.progress(num_partitions)
+        fuse.partitioned_fuse({"workers": 2}, duckdb.connect(database=":memory:"), self.data_contracts, self.public_keys, self.engine, progress, 4, num_partitions)
+        manifest = partition.load_manifest(self.config_location)
+        self.assertEqual(sum(manifest["bucket_rows"]), 20)
+        results = [partition.intersect_bucket_worker(self.config_location, bucket, 2) for bucket in range(num_partitions)]
+        self.assertEqual(partition.merge_bucket_results(results, 2)["overlap"][0][1], 5)
+
+    def test_partitioned_publish_can_be_repeated(self):
+        """
+        A FUSE re-sent after the partitions were published, but before the checkpoint was cleared, keeps them
+        """
+        num_partitions = 3
+        progress = self.progress(num_partitions)
+        for _ in range(2):
+            fuse.partitioned_fuse({"workers": 2}, duckdb.connect(database=":memory:"), self.data_contracts, self.public_keys, self.engine, progress, 4, num_partitions)
+            results = [partition.intersect_bucket_worker(self.config_location, bucket, 2) for bucket in range(num_partitions)]
+            self.assertEqual(partition.merge_bucket_results(results, 2)["overlap"], [[10, 5], [5, 10]])
+            self.assertEqual(sum(partition.load_manifest(self.config_location)["bucket_rows"]), 20)
+
+    def test_partitioned_publish_interrupted_during_swap(self):
+        """
+        A crash after the previous partitions were removed and before the staged ones were swapped in is recovered
+        """
+        num_partitions = 3
+        progress = self.progress(num_partitions)
+        replace = os.replace
+
+        def crashing_replace(staged, target):
+            if target == partition.partitions_location(self.config_location):
+                raise MemoryError("cage restarted")
+            replace(staged, target)
+
+        with mock.patch.object(fuse.os, "replace", crashing_replace):
+            with self.assertRaises(MemoryError):
+                fuse.partitioned_fuse({"workers": 2}, duckdb.connect(database=":memory:"), self.data_contracts, self.public_keys, self.engine, progress, 4, num_partitions)
+        fuse.partitioned_fuse({"workers": 2}, duckdb.connect(database=":memory:"), self.data_contracts, self.public_keys, self.engine, progress, 4, num_partitions)
+        results = [partition.intersect_bucket_worker(self.config_location, bucket, 2) for bucket in range(num_partitions)]
+        self.assertEqual(partition.merge_bucket_results(results, 2)["overlap"], [[10, 5], [5, 10]])
+
+    def test_partitioned_resume_after_failed_chunk(self):
+        """
+        A failed chunk keeps the chunks completed by the other workers, the next FUSE only computes the failed one
+        """
+        num_partitions = 3
+        marker = checkpoint.checkpoint_location(self.config_location) + "/fail"
+        progress = self.progress(num_partitions)
+        with open(marker, "w") as f:
+            f.write("")
+        with mock.patch.object(partition, "encrypt_chunk_worker", failing_encrypt_chunk_worker):
+            with self.assertRaises(MemoryError):
+                fuse.partitioned_fuse({"workers": 2}, duckdb.connect(database=":memory:"), self.data_contracts, self.public_keys, self.engine, progress, 4, num_partitions)
+        self.assertFalse(os.path.exists(partition.partitions_location(self.config_location)))
+        progress = self.progress(num_partitions)
+        self.assertEqual(sorted(progress["contracts"]["contract0"]["completed"]), ["1", "2"])
+        self.assertEqual(sorted(progress["contracts"]["contract1"]["completed"]), ["0", "1", "2"])
+
+        os.remove(marker)
+        submitted = []
+        with mock.patch.object(partition, "encrypt_chunk_worker", failing_encrypt_chunk_worker):
+            submit = fuse.ProcessPoolExecutor.submit
+
+            def recording_submit(executor, fn, *args):
+                submitted.append(args[1:3])
+                return submit(executor, fn, *args)
+
+            with mock.patch.object(fuse.ProcessPoolExecutor, "submit", recording_submit):
+                fuse.partitioned_fuse({"workers": 2}, duckdb.connect(database=":memory:"), self.data_contracts, self.public_keys, self.engine, progress, 4, num_partitions)
+        self.assertEqual(submitted, [(0, 0)])
+        results = [partition.intersect_bucket_worker(self.config_location, bucket, 2) for bucket in range(num_partitions)]
+        self.assertEqual(partition.merge_bucket_results(results, 2)["overlap"], [[10, 5], [5, 10]])
@@ -0,0 +1,57 @@
+"""
+Unit test of the commutative encryption engines.
+"""
+
+import json
+import unittest
+
+import commutative
+
+
+class Test(unittest.TestCase):
+    def assert_commutative(self, engine, keys):
+        """
+        Both data holders encrypt with their own key, the TEE adds the key of the other one
+        """
+        participants = ["participant0", "participant1"]
+        public_keys = dict(zip(participants, keys))
+        encrypted = [engine.encrypt(engine.hash_identifier("john.doe@example.com"), key) for key in keys]
+        fused = [commutative.tee_commutative_encrypt(value, participant, public_keys, engine) for value, participant in zip(encrypted, participants)]
+        self.assertEqual(fused[0], fused[1])
+        other = engine.encrypt(engine.hash_identifier("jane.doe@example.com"), keys[0])
+        self.assertNotEqual(commutative.tee_commutative_encrypt(other, participants[0], public_keys, engine), fused[0])
+        return fused[0]
+
+    def test_modexp_engine(self):
+        """
+        Key material written before engines existed is read as modexp
+        """
+        with open('tests/fixtures/shared_modulus.json') as f:
+            engine = commutative.get_engine(json.load(f))
+        with open('tests/fixtures/public_keys.json') as f:
+            keys = list(json.load(f).values())[:2]
+        self.assertEqual(engine.name, "modexp")
+        self.assert_commutative(engine, keys)
+
+    def test_ristretto255_engine(self):
+        shared, keys = commutative.generate_key_material("ristretto255", 2)
+        engine = commutative.get_engine(json.loads(json.dumps(shared)))
+        self.assertEqual(engine.name, "ristretto255")
+        fused = self.assert_commutative(engine, keys)
+        self.assertEqual(len(bytes.fromhex(fused)), 32)
+
+    def test_unknown_engine(self):
+        with self.assertRaises(ValueError):
+            commutative.generate_key_material("unknown", 2)
+
+    def test_ristretto255_rotation_key(self):
+        """
+        A single rotation scalar moves a fused id to the new keys
+        """
+        shared, keys = commutative.generate_key_material("ristretto255", 3)
+        engine = commutative.get_engine(shared)
+        new_keys = engine.rotate_keys(shared, 3)
+        point = engine.hash_identifier("john.doe@example.com")
+        fused = commutative.tee_commutative_encrypt(point, None, dict(enumerate(keys)), engine)
+        rotated = engine.encrypt(fused, engine.rotation_key(shared, keys, new_keys))
+        self.assertEqual(rotated, commutative.tee_commutative_encrypt(point, None, dict(enumerate(new_keys)), engine))
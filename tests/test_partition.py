@@ -0,0 +1,77 @@
+"""
+Unit test of the partitioned fusion and intersection.
+"""
+
+import json
+import os
+import tempfile
+import unittest
+from concurrent.futures import ProcessPoolExecutor
+from unittest import mock
+
+import duckdb
+
+import checkpoint
+import fuse
+import partition
+from commutative import get_engine
+from dv_utils import default_settings
+from tests.test_checkpoint import DataContract
+
+
+class Test(unittest.TestCase):
+    def setUp(self):
+        with open('tests/fixtures/shared_modulus.json') as f:
+            self.engine = get_engine(json.load(f))
+        with open('tests/fixtures/public_keys.json') as f:
+            self.public_keys = json.load(f)
+        self.participants = ["66e1a579eb0cbee048a2bd04", "66e1a4eaeb0cbee048a2bcf3"]
+
+    def holder_table(self, path, participant, values):
+        """
+        Write a data holder table, encrypted with the key of the holder like in data/create_synthetic_data.py
+        """
+        emails = [str(self.engine.encrypt(value, self.public_keys[participant])) for value in values]
+        con = duckdb.connect(database=":memory:")
+        # amounts of the first rows are unknown, typed columns must not depend on the values of a chunk
+        amounts = [None if value < 10 else value * 1.5 for value in values]
+        con.execute("COPY (SELECT UNNEST(?) AS customer_id, UNNEST(?) AS customer_email, UNNEST(?::DOUBLE[]) AS amount) TO '" + path + "' (FORMAT PARQUET)", [[str(value) for value in values], emails, amounts])
+        con.close()
+
+    def test_partitioned_fuse_and_intersect(self):
+        """
+        Fuse 2 tables in 4 partitions with worker processes and check the merged overlap matrix
+        """
+        num_partitions = 4
+        chunk_size = 7
+        with tempfile.TemporaryDirectory() as config_location, tempfile.TemporaryDirectory() as data_location:
+            data_contracts = []
+            for i, values in enumerate([range(2, 22), range(12, 42)]):
+                path = data_location + "/customers-list" + str(i) + ".parquet"
+                self.holder_table(path, self.participants[i], list(values))
+                data_contracts.append(DataContract("contract" + str(i), path))
+            os.makedirs(checkpoint.checkpoint_location(config_location))
+            # same snapshot and chunking as the partitioned FUSE
+            with mock.patch.object(default_settings, "data_connector_config_location", config_location):
+                con = duckdb.connect(database=":memory:")
+                num_rows = [fuse.snapshot_source(con, data_contract, i) for i, data_contract in enumerate(data_contracts)]
+                con.close()
+            with ProcessPoolExecutor(max_workers=2) as executor:
+                futures = []
+                for i in range(len(data_contracts)):
+                    source = checkpoint.source_path(config_location, i)
+                    for chunk_index in range(checkpoint.num_chunks(num_rows[i], chunk_size)):
+                        futures.append(executor.submit(partition.encrypt_chunk_worker, config_location, i, chunk_index, source, chunk_index * chunk_size, chunk_size, self.participants[i], self.public_keys, self.engine, num_partitions))
+                written = sum(sum(future.result().values()) for future in futures)
+                self.assertEqual(written, 50)
+
+                results = list(executor.map(partition.intersect_bucket_worker, [config_location] * num_partitions, range(num_partitions), [2] * num_partitions))
+
+            con = duckdb.connect(database=":memory:")
+            columns = con.sql("DESCRIBE SELECT * FROM read_parquet('" + partition.bucket_location(config_location, "*") + "/customers_list_0-*.parquet')").fetchall()
+            self.assertEqual([column[:2] for column in columns], [("customer_id", "VARCHAR"), ("customer_email", "VARCHAR"), ("amount", "DOUBLE"), ("commutative_id", "VARCHAR")])
+            con.close()
+
+            merged = partition.merge_bucket_results(results, 2)
+            self.assertEqual(merged["rows"], [20, 30])
+            self.assertEqual(merged["overlap"], [[20, 10], [10, 30]])
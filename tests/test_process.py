@@ -7,6 +7,8 @@ import dotenv
 dotenv.load_dotenv('.env')
 import unittest
 import logging
+import subprocess
+import sys
 import process
 
 class Test(unittest.TestCase):
@@ -20,6 +22,23 @@ class Test(unittest.TestCase):
 
     #     process.event_processor(test_event)
     
+    def test_event_processor_registry(self):
+        """
+        Event processors are resolved from the registry, unknown events use the generic event processor
+        """
+        processor = process.get_event_processor("CHECK_COMMON_CUSTOMERS")
+        self.assertEqual(processor.__module__, "checks")
+        self.assertIs(process.get_event_processor("CHECK_COMMON_CUSTOMERS"), processor)
+        self.assertIs(process.get_event_processor("UNKNOWN"), process.generic_event_processor)
+
+    def test_import_is_lazy(self):
+        """
+        Importing the listener entry point does not load the event processors and their heavy dependencies
+        """
+        code = "import sys, process; print([name for name in ('sympy', 'pandas', 'fuse', 'initialize') if name in sys.modules])"
+        completed = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+        self.assertEqual(completed.stdout.strip().splitlines()[-1], "[]")
+
     def test_fuse(self):
         """
         Try the process to initialize
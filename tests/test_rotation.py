@@ -0,0 +1,189 @@
+"""
+Unit test of the key rotation.
+"""
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import duckdb
+import pandas as pd
+from sympy import nextprime
+
+import commutative
+import partition
+import process
+import rotation
+from dv_utils import default_settings
+
+
+class Test(unittest.TestCase):
+    def setUp(self):
+        self.config_location = tempfile.mkdtemp()
+        self.output_location = tempfile.mkdtemp()
+        # small modulus with a consistent phi, rotation needs phi(n) of the fused ids
+        p, q = nextprime(2**127), nextprime(2**128)
+        shared = {"engine": "modexp", "phi": (p - 1) * (q - 1), "n": p * q}
+        keys = commutative.generate_unique_commutative_keys(shared["phi"], 3)
+        self.public_keys = dict(zip(["66e1a419eb0cbee048a2bce3", "66e1a579eb0cbee048a2bd04", "66e1a4eaeb0cbee048a2bcf3"], keys))
+        self.engine = commutative.get_engine(shared)
+        rotation.write_json(self.config_location + "/shared_modulus.json", shared)
+        rotation.write_json(self.config_location + "/public_keys.json", self.public_keys)
+        self.settings = [
+            mock.patch.object(default_settings, "data_connector_config_location", self.config_location),
+            mock.patch.object(default_settings, "data_user_output_location", self.output_location),
+        ]
+        for setting in self.settings:
+            setting.start()
+
+    def tearDown(self):
+        for setting in self.settings:
+            setting.stop()
+        shutil.rmtree(self.config_location)
+        shutil.rmtree(self.output_location)
+
+    def fused_id(self, value, public_keys):
+        return str(commutative.tee_commutative_encrypt(value, None, public_keys, self.engine))
+
+    def fused_table(self, values):
+        return pd.DataFrame({
+            "customer_email": [str(value) for value in values],
+            "commutative_id": [self.fused_id(value, self.public_keys) for value in values],
+        }).astype(object)
+
+    def rotate(self):
+        rotation.rotate_keys_event_processor({"type": "ROTATE_KEYS", "batch_size": 4, "workers": 2})
+        with open(self.config_location + "/public_keys.json") as f:
+            return json.load(f)
+
+    def test_rotate_exported_database(self):
+        """
+        Fused ids of the exported database are moved to the new keys, the modulus is kept
+        """
+        con = duckdb.connect(database=":memory:")
+        table_0 = self.fused_table(range(2, 12))
+        table_1 = self.fused_table(range(7, 17))
+        con.sql("CREATE TABLE customers_list_0 AS SELECT * FROM table_0")
+        con.sql("CREATE TABLE customers_list_1 AS SELECT * FROM table_1")
+        con.sql("EXPORT DATABASE '" + self.config_location + "' (FORMAT PARQUET)")
+        con.close()
+
+        new_public_keys = self.rotate()
+        self.assertEqual(set(new_public_keys), set(self.public_keys))
+        self.assertNotEqual(new_public_keys, self.public_keys)
+        with open(self.config_location + "/shared_modulus.json") as f:
+            self.assertEqual(json.load(f)["n"], self.engine.n)
+        for participant_id, key in new_public_keys.items():
+            with open(self.output_location + "/" + participant_id + "_keys.json") as f:
+                self.assertEqual(json.load(f)["public-key"], key)
+
+        con = duckdb.connect(database=":memory:")
+        con.sql("IMPORT DATABASE '" + self.config_location + "'")
+        rotated = con.sql("SELECT customer_email, commutative_id FROM customers_list_0 ORDER BY CAST(customer_email AS INTEGER)").fetchall()
+        self.assertEqual(rotated, [(str(value), self.fused_id(value, new_public_keys)) for value in range(2, 12)])
+        total = con.sql("SELECT COUNT(*) FROM customers_list_0,customers_list_1 WHERE (customers_list_0.commutative_id=customers_list_1.commutative_id)").fetchone()[0]
+        self.assertEqual(total, 5)
+        self.assertFalse(os.path.exists(rotation.staging_location(self.config_location)))
+
+    def test_rotate_keeps_column_types(self):
+        """
+        Only the commutative_id is rewritten, typed columns and NULL values are kept as exported
+        """
+        con = duckdb.connect(database=":memory:")
+        fused_ids = [self.fused_id(value, self.public_keys) for value in range(2, 12)]
+        con.execute(
+            "CREATE TABLE customers_list_0 AS SELECT customer_id, CASE WHEN customer_id < 6 THEN NULL ELSE customer_id * 1.5 END::DOUBLE AS amount,"
+            " DATE '2024-01-01' + customer_id::INTEGER AS signup, commutative_id FROM (SELECT UNNEST(?) AS customer_id, UNNEST(?) AS commutative_id)",
+            [list(range(2, 12)), fused_ids],
+        )
+        columns = con.sql("DESCRIBE customers_list_0").fetchall()
+        expected = con.sql("SELECT customer_id, amount, signup FROM customers_list_0 ORDER BY customer_id").fetchall()
+        con.sql("EXPORT DATABASE '" + self.config_location + "' (FORMAT PARQUET)")
+        con.close()
+
+        new_public_keys = self.rotate()
+        con = duckdb.connect(database=":memory:")
+        con.sql("IMPORT DATABASE '" + self.config_location + "'")
+        self.assertEqual(con.sql("DESCRIBE customers_list_0").fetchall(), columns)
+        rotated = con.sql("SELECT customer_id, amount, signup, commutative_id FROM customers_list_0 ORDER BY customer_id").fetchall()
+        self.assertEqual([row[:3] for row in rotated], expected)
+        self.assertEqual([row[3] for row in rotated], [self.fused_id(value, new_public_keys) for value in range(2, 12)])
+
+    def test_rotate_partitions(self):
+        """
+        Rows of a partitioned fusion move to the bucket of their new commutative_id
+        """
+        num_partitions = 3
+        con = duckdb.connect(database=":memory:")
+        for i, values in enumerate([range(2, 12), range(7, 17)]):
+            con.execute("CREATE OR REPLACE TABLE fused AS SELECT UNNEST(?) AS file_row_number, UNNEST(?) AS customer_email", [list(range(len(values))), [str(value) for value in values]])
+            partition.write_buckets(con, self.config_location, i, 0, "fused", list(range(len(values))), [self.fused_id(value, self.public_keys) for value in values], num_partitions)
+        con.close()
+        partition.write_manifest(self.config_location, {"partitions": num_partitions, "tables": 2, "bucket_rows": []})
+
+        new_public_keys = self.rotate()
+        results = [partition.intersect_bucket_worker(self.config_location, bucket, 2) for bucket in range(num_partitions)]
+        merged = partition.merge_bucket_results(results, 2)
+        self.assertEqual(merged["overlap"], [[10, 5], [5, 10]])
+        self.assertEqual(sum(partition.load_manifest(self.config_location)["bucket_rows"]), 20)
+        found = partition.lookup_commutative_id(self.config_location, self.fused_id(8, new_public_keys), num_partitions, 2)
+        self.assertEqual(found, [True, True])
+
+    def test_complete_interrupted_swap(self):
+        """
+        A committed journal is replayed, files already swapped are skipped
+        """
+        staging = rotation.staging_location(self.config_location)
+        os.makedirs(staging)
+        rotation.write_json(staging + "/public_keys.json", {"participant": 2})
+        rotation.write_json(self.config_location + "/" + rotation.ROTATION_JOURNAL, {
+            "generation": 1,
+            "swap": [
+                [staging + "/already_swapped.json", self.config_location + "/already_swapped.json"],
+                [staging + "/public_keys.json", self.config_location + "/public_keys.json"],
+            ],
+        })
+        self.assertTrue(rotation.complete_pending_rotation(self.config_location))
+        with open(self.config_location + "/public_keys.json") as f:
+            self.assertEqual(json.load(f), {"participant": 2})
+        self.assertFalse(rotation.complete_pending_rotation(self.config_location))
+
+    def test_swap_stays_on_the_target_filesystem(self):
+        """
+        Config and output locations are separate mounts in the cage, a rename across them fails
+        """
+        replace = os.replace
+
+        def same_mount_replace(staged, target):
+            for location in (self.config_location, self.output_location):
+                if target.startswith(location) and not staged.startswith(location):
+                    raise OSError(18, "Invalid cross-device link")
+            replace(staged, target)
+
+        with mock.patch.object(rotation.os, "replace", same_mount_replace):
+            new_public_keys = self.rotate()
+        self.assertNotEqual(new_public_keys, self.public_keys)
+        for participant_id, key in new_public_keys.items():
+            with open(self.output_location + "/" + participant_id + "_keys.json") as f:
+                self.assertEqual(json.load(f)["public-key"], key)
+        self.assertFalse(os.path.exists(self.config_location + "/" + rotation.ROTATION_JOURNAL))
+        self.assertFalse(os.path.exists(rotation.staging_location(self.output_location)))
+
+    def test_failing_replay_does_not_block_events(self):
+        """
+        The dispatcher logs a journal that cannot be replayed instead of failing every event
+        """
+        self.assertEqual(process.ROTATION_JOURNAL, rotation.ROTATION_JOURNAL)
+        rotation.write_json(self.config_location + "/" + rotation.ROTATION_JOURNAL, {
+            "generation": 1,
+            "swap": [[self.output_location + "/missing_dir/", self.config_location + "/public_keys.json"]],
+            "staging": [],
+        })
+        with mock.patch.object(rotation.os, "replace", side_effect=OSError(18, "Invalid cross-device link")):
+            os.makedirs(self.output_location + "/missing_dir")
+            with self.assertLogs("process", level="ERROR"):
+                process.complete_pending_rotation()
+        self.assertTrue(os.path.exists(self.config_location + "/" + rotation.ROTATION_JOURNAL))